@@ -0,0 +1,215 @@
+from fpdf import FPDF
+
+CURRENCY_SET = frozenset(['RetroRate', 'Rate', 'Retro_Value', 'Retro Value', 'Retro Rate'])
+INT_SET = frozenset(['Contract', 'Contract_Reference_Number'])
+
+_FORBIDDEN = str.maketrans('', '', '<>:"/\\|?*')
+
+_WIDTH_CACHE_SIZE = 50000
+_string_widths = {}
+
+def clean_text(text):
+    replacements = {
+        '’': "'",
+        '‘': "'",
+        '“': '"',
+        '”': '"',
+        '–': '-',  # en dash
+        '—': '-',  # em dash
+        '…': '...',  # ellipsis
+        '•': '-',  # bullet
+    }
+    for orig, repl in replacements.items():
+        text = text.replace(orig, repl)
+    return text
+
+def cached_string_width(pdf, text):
+    # Widths only depend on the active font, so repeated tokens (supplier names, CCNs, ...) are measured once.
+    key = (pdf.font_family, pdf.font_style, pdf.font_size_pt, text)
+    width = _string_widths.get(key)
+    if width is None:
+        if len(_string_widths) >= _WIDTH_CACHE_SIZE:
+            _string_widths.clear()
+        width = _string_widths[key] = pdf.get_string_width(text)
+    return width
+
+def is_missing(item):
+    # Empty cells come through as None; NaN is the only value not equal to itself
+    return item is None or item != item
+
+def sanitize_filename(name):
+    name = str(name).translate(_FORBIDDEN).replace(' ', '_')[:50]
+    return name or "default"
+
+def calculate_column_widths(headers, pdf, max_width=500, fixed_width=30):
+    col_widths = []
+    for j, header in enumerate(headers):  #CHANGED: Added header to check for "Details"
+        pdf.set_font('Arial', 'B', 8)
+        width = cached_string_width(pdf, str(header) or "") + 6  # CHANGED: Adjusted padding to 6
+        if header == "Details":  # CHANGED: Increase width for "Details" column
+            width = max(width, 50)  # CHANGED: Minimum width of 60 for "Details"
+        else:
+            width = min(width, 30)  # CHANGED: Cap other columns at 30
+        col_widths.append(width)
+    total_width = sum(col_widths)
+    if total_width > max_width:
+        col_widths = [w * (max_width / total_width) for w in col_widths]
+    return col_widths
+
+def wrap_text(pdf, text, width):
+    # Follows PyFPDF's multi_cell line breaking: '\r' is dropped, a single trailing '\n' adds no line, and lines
+    # break at spaces, with words wider than the column split by character. multi_cell(split_only=True) gives the
+    # same lines, but measuring words through the width cache is ~2.5x faster on repeated cell text (item names,
+    # suppliers) and still slightly faster on unique text.
+    text = text.replace('\r', '')
+    if text.endswith('\n'):
+        text = text[:-1]
+    space_width = cached_string_width(pdf, ' ')
+    lines = []
+    for paragraph in text.split('\n'):
+        line = []
+        line_width = 0.0
+        for word in paragraph.split(' '):
+            word_width = cached_string_width(pdf, word)
+            if line and line_width + space_width + word_width > width:
+                lines.append(' '.join(line))
+                line = []
+            if not line and word_width > width:
+                chunk, chunk_width = '', 0.0
+                for char in word:
+                    char_width = cached_string_width(pdf, char)
+                    if chunk and chunk_width + char_width > width:
+                        lines.append(chunk)
+                        chunk, chunk_width = '', 0.0
+                    chunk += char
+                    chunk_width += char_width
+                word, word_width = chunk, chunk_width
+            line_width = line_width + space_width + word_width if line else word_width
+            line.append(word)
+        lines.append(' '.join(line))
+    return lines
+
+def format_cell(item, is_int, is_currency):
+    # Sheets are sparse, so empty cells skip all of the formatting below
+    if item is None or item == "":
+        return ""
+    if is_int:
+        item = "" if is_missing(item) else int(item)
+
+    if isinstance(item, (int, float)):
+        # Remove .0 if it's a whole number
+        if isinstance(item, float) and item.is_integer():
+            item = str(int(item))
+        else:
+            item = round(item, 2)
+
+    if is_currency and not is_missing(item):
+        try:
+            content = f"£{float(item):.2f}"
+        except (ValueError, TypeError):
+            content = str(item)
+    else:
+        content = "" if is_missing(item) else str(item)
+
+    return clean_text(content)
+
+def render_page(idx, cell_range, headers, col_widths, rows):
+    # Runs in a worker process, so it only receives plain Python data (openpyxl objects are not picklable)
+    # Per-column formatting flags, resolved once per page instead of per cell
+    header_font_size = [6 if h in ['Contract_Reference_Number', 'BrandSupplierDescription'] else 8 for h in headers]
+    col_font_size = [6 if h == 'Item Name' else 7 for h in headers]
+    col_is_currency = [h in CURRENCY_SET for h in headers]
+    col_is_int = [h in INT_SET for h in headers]
+
+    brand_idx = 2
+    ccn_idx = headers.index('CCN') if 'CCN' in headers else None
+    if not rows:
+        print("Data is unexpectedly empty before file name creation.")
+        print(cell_range)
+        file_name = f"{idx}.pdf"
+    else:
+        file_name = (f"{sanitize_filename(rows[0][brand_idx])}_{sanitize_filename(rows[0][ccn_idx])}.pdf"
+                        if brand_idx is not None and ccn_idx is not None 
+                        else f"{idx}.pdf"
+                        )
+
+    pdf = FPDF(orientation='L')
+    pdf.add_page()
+    pdf.set_font('Arial', '', 8)
+    row_height = 4
+
+    # Headers
+    start_y = pdf.get_y()
+    start_x = pdf.l_margin  # Start at the left margin
+    pdf.set_xy(start_x, start_y)
+    pdf.set_fill_color(200, 200, 200)
+    for j, header in enumerate(headers):
+        pdf.set_font('Arial', 'B', header_font_size[j])
+        pdf.cell(col_widths[j], row_height * 2, str(header) or "", border=1, fill=True, align='C')
+        start_x += col_widths[j]  # Move to the next column position
+        pdf.set_xy(start_x, start_y)
+    pdf.ln(row_height * 2)
+
+
+    # Data, formatted one column at a time so the drawing loop below only looks up strings
+    fmt_cols = [[format_cell(item, col_is_int[j], col_is_currency[j]) for item in column]
+                for j, column in enumerate(zip(*rows))]
+    effective_page_height = pdf.h - pdf.t_margin - pdf.b_margin  # Usable height (e.g., ~170 for landscape A4)
+    col_x = [pdf.l_margin + sum(col_widths[:j]) for j in range(len(fmt_cols))]
+    table_y = pdf.get_y()
+
+    # Measurement pass: line-break the cells that need wrapping and work out how tall each row ends up
+    wrapped = []
+    row_heights = [row_height] * len(rows)
+    for j, column in enumerate(fmt_cols):
+        pdf.set_font('Arial', '', col_font_size[j])
+        usable_width = col_widths[j] - 2 * pdf.c_margin
+        col_lines = []
+        for row_idx, content in enumerate(column):
+            # Most cells fit on one line; only the rest are wrapped (None marks a single-line cell)
+            if not content or ('\n' not in content and '\r' not in content
+                               and cached_string_width(pdf, content) <= usable_width):
+                col_lines.append(None)
+                continue
+            lines = wrap_text(pdf, content, usable_width)
+            row_heights[row_idx] = max(row_heights[row_idx], len(lines) * row_height)
+            col_lines.append(lines)
+        wrapped.append(col_lines)
+
+    # Layout pass: give every row its page and y position up front
+    pages = [[]]
+    current_y = table_y
+    for row_idx, height in enumerate(row_heights):
+        if pages[-1] and current_y + height > effective_page_height:
+            pages.append([])
+            current_y = pdf.t_margin
+        pages[-1].append((row_idx, current_y))
+        current_y += height
+
+    # Render pass: draw each page's white rows then its grey rows, so the fill colour is set twice per page
+    pdf.set_auto_page_break(False, margin=pdf.b_margin)  # Pagination was decided above
+    for page_idx, page_rows in enumerate(pages):
+        if page_idx:
+            pdf.add_page()
+        for parity, row_color in ((0, (255, 255, 255)), (1, (230, 230, 230))):
+            pdf.set_fill_color(*row_color)
+            batch = [(row_idx, y) for row_idx, y in page_rows if row_idx % 2 == parity]
+            for j, column in enumerate(fmt_cols):
+                pdf.set_font('Arial', '', col_font_size[j])
+                for row_idx, y in batch:
+                    content = column[row_idx]
+                    if not content:
+                        # Only the stripe background is needed, so skip fpdf's text handling entirely
+                        pdf.rect(col_x[j], y, col_widths[j], row_height, style='F')
+                    elif wrapped[j][row_idx]:
+                        # Draw the lines worked out above rather than line-breaking again with multi_cell
+                        for k, line in enumerate(wrapped[j][row_idx]):
+                            pdf.set_xy(col_x[j], y + k * row_height)
+                            pdf.cell(col_widths[j], row_height, line, border=0, align='C', fill=True)
+                    else:
+                        pdf.set_xy(col_x[j], y)
+                        pdf.cell(col_widths[j], row_height, content, border=0, align='C', fill=True)
+
+    pdf_bytes = pdf.output(dest='S').encode('latin-1')
+    print(f"PDF {file_name} generated with {pdf.page_no()} pages")
+    return file_name, pdf_bytes
@@ -1,247 +1,133 @@
 import streamlit as st
 from openpyxl import load_workbook
-from openpyxl.utils.cell import get_column_letter
-import pandas as pd
-from fpdf import FPDF
+from openpyxl.xml.constants import SHEET_MAIN_NS
+from openpyxl.xml.functions import iterparse
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import zipfile
-import re
-
-def clean_text(text):
-    replacements = {
-        '’': "'",
-        '‘': "'",
-        '“': '"',
-        '”': '"',
-        '–': '-',  # en dash
-        '—': '-',  # em dash
-        '…': '...',  # ellipsis
-        '•': '-',  # bullet
-    }
-    for orig, repl in replacements.items():
-        text = text.replace(orig, repl)
-    return text
+import io
+from fpdf import FPDF
+from pdf_render import calculate_column_widths, render_page
+
+class EmptySheetError(ValueError):
+    pass
 
 def load_excel(file_path):
-    return load_workbook(filename=file_path, data_only=True)
-
-def sanitize_filename(name):
-    name = re.sub(r'[<>:"/\\|?*]', '', str(name))
-    name = name.replace(' ', '_')[:50]
-    return name or "default"
-
-def get_page_ranges(sheet):
-    horizontal_breaks = [0] + [page_break.id for page_break in sheet.row_breaks.brk]
-    last_cell = sheet.dimensions.split(":")[1]
-    last_col = ''.join(c for c in last_cell if c.isalpha())
-    last_row = ''.join(c for c in last_cell if c.isdigit())
+    # Read-only mode streams the sheet XML instead of building the full cell/style object model
+    return load_workbook(filename=file_path, data_only=True, read_only=True, keep_links=False)
+
+def get_row_breaks(sheet):
+    # Read-only worksheets don't expose row_breaks, so pull <rowBreaks> out of the sheet XML in one streaming pass.
+    # _get_source() is private openpyxl API (hence the pinned version); openpyxl's iterparse is defusedxml-hardened.
+    source = sheet._get_source()
+    try:
+        for _, element in iterparse(source):
+            if element.tag == f'{{{SHEET_MAIN_NS}}}rowBreaks':
+                return [int(brk.get('id')) for brk in element.iter(f'{{{SHEET_MAIN_NS}}}brk')]
+            if element.tag == f'{{{SHEET_MAIN_NS}}}row':
+                element.clear()
+    finally:
+        source.close()
+    return []
+
+def get_page_ranges(sheet, rows):
+    horizontal_breaks = [0] + get_row_breaks(sheet)
+    last_row = len(rows)
     pages = {}
     for idx, h_break in enumerate(horizontal_breaks):
         start_row = h_break + 1
-        end_row = horizontal_breaks[idx + 1] if idx + 1 < len(horizontal_breaks) else int(last_row)
+        end_row = horizontal_breaks[idx + 1] if idx + 1 < len(horizontal_breaks) else last_row
         if idx == 0: start_row = 2
-        pages[f"Page{idx + 1}"] = f"A{start_row}:{last_col}{end_row}"
+        # 1-based (first_row, last_row), used to slice the rows read by read_rows()
+        pages[f"Page{idx + 1}"] = (start_row, end_row)
     return pages
 
-def get_table_styles(sheet):
-    styles = {}
-    for cell in sheet[1]:
-        font_name = cell.font.name.lower() if cell.font.name else 'arial'
-        styles[cell.column_letter] = {'font': font_name, 'bold': cell.font.bold}
-    return styles
-
-def calculate_column_widths(headers, data, pdf, max_width=500, fixed_width=30):
-    col_widths = []
-    for j, header in enumerate(headers):  #CHANGED: Added header to check for "Details"
-        pdf.set_font('Arial', 'B', 8)
-        width = pdf.get_string_width(str(header) or "") + 6  # CHANGED: Adjusted padding to 6
-        if header == "Details":  # CHANGED: Increase width for "Details" column
-            width = max(width, 50)  # CHANGED: Minimum width of 60 for "Details"
-        else:
-            width = min(width, 30)  # CHANGED: Cap other columns at 30
-        col_widths.append(width)
-    total_width = sum(col_widths)
-    if total_width > max_width:
-        col_widths = [w * (max_width / total_width) for w in col_widths]
-    return col_widths
-
-def save_as_pdf(sheet, page_ranges, output_folder):
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    pdf_files = []
-    headers = [cell.value for cell in sheet[1]]
-    styles = get_table_styles(sheet)
-
-    for idx, cell_range in page_ranges.items():
-        data = pd.DataFrame([[cell.value for cell in row] for row in sheet[cell_range]])
-        brand_idx = 2
-        #headers.index('BrandSupplierDescription') if 'BrandSupplierDescription' in headers else headers.index('Supplier') if 'Supplier' in headers else None       
-
-        ccn_idx = headers.index('CCN') if 'CCN' in headers else None
-        if data.empty:
-            print("Data is unexpectedly empty before file name creation.")
-            print(cell_range)
-            file_name = f"{idx}.pdf"
-        else:
-            file_name = (f"{sanitize_filename(data.iloc[0, brand_idx])}_{sanitize_filename(data.iloc[0, ccn_idx])}.pdf"
-                            if brand_idx is not None and ccn_idx is not None 
-                            else f"{idx}.pdf"
-                            )
-
-        #file_name = f"{sanitize_filename(data.iloc[0, brand_idx])}_{sanitize_filename(data.iloc[0, ccn_idx])}.pdf" \
-                    #if brand_idx is not None and ccn_idx is not None else f"{idx}.pdf"
-
-        pdf_file_path = os.path.join(output_folder, file_name)
-        pdf = FPDF(orientation='L')
-        pdf.add_page()
-        pdf.set_font('Arial', '', 8)
-        row_height = 4
-        col_widths = calculate_column_widths(headers, data, pdf)
-
-        # Headers
-        start_y = pdf.get_y()
-        start_x = pdf.l_margin  # Start at the left margin
-        pdf.set_xy(start_x, start_y)
-        for j, header in enumerate(headers):
-            col_letter = get_column_letter(j + 1)
-            if header in ['Contract_Reference_Number', 'BrandSupplierDescription']:
-                pdf.set_font('Arial', 'B', 6)
-            else:
-                pdf.set_font('Arial', 'B', 8)
-            pdf.set_fill_color(200, 200, 200)
-            pdf.cell(col_widths[j], row_height * 2, str(header) or "", border=1, fill=True, align='C')
-            start_x += col_widths[j]  # Move to the next column position
-            pdf.set_xy(start_x, start_y)
-        pdf.ln(row_height * 2)
-
-
-        # Data
-        effective_page_height = pdf.h - pdf.t_margin - pdf.b_margin  # Usable height (e.g., ~170 for landscape A4)
-        current_y = pdf.get_y()
-        for row_idx, row in data.iterrows():
-            if current_y + row_height > effective_page_height:
-                pdf.add_page()
-                current_y = pdf.get_y()
-
-            start_y = current_y
-            max_height = row_height
-            start_x = pdf.l_margin  # Reset X to the left margin for each row
-            pdf.set_xy(start_x, start_y)
-            row_color = (255, 255, 255) if row_idx % 2 == 0 else (230, 230, 230)
-            pdf.set_fill_color(*row_color)
-
-
-            for j, item in enumerate(row):
-                col_letter = get_column_letter(j + 1)
-                if headers[j] in ['Item Name']:
-                    pdf.set_font('Arial', '', 6)
-                else:
-                    pdf.set_font('Arial', '', 7)
-                if headers[j] in ['Contract', 'Contract_Reference_Number']:
-                    if pd.isna(item) or item is None:
-                         item = ""  
-                    else:
-                        item = int(item)
-
-                #if isinstance(item, (int, float)):
-                   # item = round(item, 2)
-                
-                if isinstance(item, (int, float)):
-                    # Remove .0 if it's a whole number
-                    if isinstance(item, float) and item.is_integer():
-                        item = str(int(item))
-                    else:
-                        item = round(item, 2)
-
-               
-                if headers[j] in ['RetroRate','Rate', 'Retro_Value', 'Retro Value', 'Retro Rate'] and item is not None and not pd.isna(item):
-                        try:
-                            item_float = float(item)
-                            content = f"£{item_float:.2f}"
-                        except (ValueError, TypeError):
-                            content = str(item)
-
-                else:
-                    content="" if pd.isna(item) or item is None else str(item)
-                
-
-                #if isinstance(item, (int, float)):
-                    #item = round(item, 2)
-                #content = "" if pd.isna(item) or item is None else str(item)
-                #if headers[j] in ['RetroRate', 'Retro_Value','Retro Rate'] and content:
-                    #content = f"£{content}"
-                
-                lines = []
-                words = content.split(' ')
-                current_line = ""
-                for word in words:
-                    if pdf.get_string_width(current_line + word) < col_widths[j]:
-                        current_line += word + " "
-                    else:
-                        lines.append(current_line.strip())
-                        current_line = word + " "
-                lines.append(current_line.strip())
-                wrapped_content = '\n'.join(lines)
-                
-                wrapped_content=clean_text(wrapped_content)
-                
-                pdf.multi_cell(col_widths[j], row_height, wrapped_content, align='C', border=0,fill=True)
-                cell_height = pdf.get_y() - start_y
-                max_height = max(max_height, cell_height)
-                start_x += col_widths[j]  # Move to the next column position
-                pdf.set_xy(start_x, start_y)  # Set position for the next cell
-
-            current_y = start_y + max_height
-            pdf.set_xy(pdf.l_margin, current_y)
-            #print(f"Row processed: start_y={start_y}, max_height={max_height}, current_page={pdf.page_no()}")
-
-        pdf.output(pdf_file_path)
-        print(f"PDF {file_name} generated with {pdf.page_no()} pages")
-        pdf_files.append(pdf_file_path)
-    
-    return pdf_files
-
-def zip_pdfs(pdf_files, zip_filename="generated_pdfs.zip"):
-    with zipfile.ZipFile(zip_filename, 'w') as zipf:
-        for pdf_file in pdf_files:
-            zipf.write(pdf_file)
-    return zip_filename
+def read_rows(sheet):
+    # A single pass over the sheet: read-only worksheets re-parse the XML from the top on every iter_rows() call.
+    # The file's <dimension> element may be stale, so ignore it and size the table from the rows actually read.
+    sheet.reset_dimensions()
+    rows = list(sheet.iter_rows(values_only=True))
+    last_col = max((len(row) for row in rows), default=0)
+    # Rows missing from the XML (blank rows, data not starting at row 1) come back as empty lists
+    return [tuple(row) + (None,) * (last_col - len(row)) for row in rows]
+
+def save_as_pdf(rows, page_ranges):
+    headers = list(rows[0])
+    # Widths only depend on the headers, so they are measured once per sheet rather than once per page
+    col_widths = calculate_column_widths(headers, FPDF(orientation='L'))
+
+    # Plain row slices rather than openpyxl objects, because the workbook can't be sent to worker processes
+    jobs = [(idx, cell_range, rows[cell_range[0] - 1:cell_range[1]]) for idx, cell_range in page_ranges.items()]
+
+    workers = min(len(jobs), os.cpu_count() or 1)
+    if workers <= 1:
+        # A pool only adds start-up and pickling overhead when there is nothing to run alongside
+        for idx, cell_range, page_rows in jobs:
+            yield render_page(idx, cell_range, headers, col_widths, page_rows)
+        return
+
+    # Spawn rather than fork: the Streamlit server is multithreaded, and forking it can deadlock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(render_page, idx, cell_range, headers, col_widths, page_rows)
+                   for idx, cell_range, page_rows in jobs]
+        # Yield in page order as each render finishes so zipping overlaps with rendering
+        for future in futures:
+            yield future.result()
+
+def zip_pdfs(pdf_pages):
+    buffer = io.BytesIO()
+    # PDF streams are already compressed, so the fastest deflate level is enough
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zipf:
+        for file_name, pdf_bytes in pdf_pages:
+            zipf.writestr(file_name, pdf_bytes)
+        pdf_count = len(zipf.infolist())
+    return buffer.getvalue(), pdf_count
+
+# Bounded, since every distinct upload's zip would otherwise stay in server memory for good
+@st.cache_data(show_spinner=False, max_entries=8, ttl=3600)
+def generate_zip(xlsx_bytes):
+    # Keyed on the upload's bytes, so reruns (e.g. clicking the download button) skip parsing and rendering
+    workbook = load_excel(io.BytesIO(xlsx_bytes))
+    try:
+        sheet = workbook.worksheets[0]
+        rows = read_rows(sheet)
+        if not rows:
+            raise EmptySheetError("The first sheet of the workbook is empty.")
+        page_ranges = get_page_ranges(sheet, rows)
+        if not page_ranges:
+            return None
+        return zip_pdfs(save_as_pdf(rows, page_ranges))
+    finally:
+        # Read-only workbooks keep the archive open until closed
+        workbook.close()
 
 def main():
     st.title("Excel to PDF Generator")
     uploaded_file = st.file_uploader("Upload your Excel file (Updated Aug 2025) ", type=["xlsx"])
 
     if uploaded_file is not None:
-        file_path = uploaded_file.name
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-
         try:
-            workbook = load_excel(file_path)
-            sheet = workbook.worksheets[0]
-            page_ranges = get_page_ranges(sheet)
+            result = generate_zip(uploaded_file.getvalue())
 
-            if not page_ranges:
+            if result is None:
                 st.warning("⚠️ No page breaks detected. Ensure page breaks are set.")
                 return
 
-            pdf_files = save_as_pdf(sheet, page_ranges, "generated_pdfs")
-            zip_file = zip_pdfs(pdf_files)
+            zip_bytes, pdf_count = result
             
-            with open(zip_file, "rb") as file:
-                st.download_button(
-                    label="📥 Download PDFs",
-                    data=file,
-                    file_name=zip_file,
-                    mime="application/zip"
-                )
+            st.download_button(
+                label="📥 Download PDFs",
+                data=zip_bytes,
+                file_name="generated_pdfs.zip",
+                mime="application/zip"
+            )
             
-            st.success(f"{len(pdf_files)} PDFs successfully generated!")
+            st.success(f"{pdf_count} PDFs successfully generated!")
             
 
-        except FileNotFoundError as e:
-            st.error(f"Error: {e}")
+        except EmptySheetError as e:
+            st.warning(f"⚠️ {e}")
         except Exception as e:
             st.error(f"Unexpected error: {e}")
 